@@ -5,102 +5,124 @@ Debug script to inspect urlwatch database structure and contents.
 
 import sqlite3
 import os
+import sys
 from datetime import datetime
+from pathlib import Path
 
 DB_PATH = os.path.expanduser('~/.cache/urlwatch/cache.db')
 
 def inspect_database():
     """Inspect the database structure and sample data."""
-    if not os.path.exists(DB_PATH):
+    # mode=ro never creates the file, so opening it doubles as the existence
+    # check (no separate stat of DB_PATH)
+    try:
+        conn = sqlite3.connect(f"{Path(DB_PATH).as_uri()}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
         print(f"❌ Database not found at: {DB_PATH}")
         return
     
-    print(f"🔍 Inspecting database: {DB_PATH}")
-    print("=" * 60)
+    # Collect the output and write it to stdout in one go
+    parts = []
+    out = parts.append
+    
+    out(f"🔍 Inspecting database: {DB_PATH}")
+    out("=" * 60)
     
     try:
-        conn = sqlite3.connect(DB_PATH)
+        # Tune the read-only connection for scans: no writes, in-memory temp
+        # storage, mmap'd reads and a 64 MiB page cache
+        conn.executescript("""
+            PRAGMA query_only=1;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA cache_size=-65536;
+        """)
         cursor = conn.cursor()
         
-        # 1. List all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        print(f"📋 Tables found: {[t[0] for t in tables]}")
-        print()
+        # 1. List all tables with their columns in a single schema query
+        cursor.execute("""
+            SELECT m.name, p.name, p.type, p.pk
+            FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+            WHERE m.type = 'table'
+            ORDER BY m.rowid, p.cid;
+        """)
+        schema = {}
+        for table_name, col_name, col_type, pk in cursor:
+            schema.setdefault(table_name, []).append((col_name, col_type, pk))
+        out(f"📋 Tables found: {list(schema)}")
+        out("")
         
-        # 2. Inspect each table
-        for table_name, in tables:
-            print(f"🔎 Table: {table_name}")
-            print("-" * 40)
+        # 2. Inspect each table (column names are kept for the analysis below)
+        table_columns = {}
+        for table_name, columns in schema.items():
+            out(f"🔎 Table: {table_name}")
+            out("-" * 40)
             
-            # Get table schema
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-            print("Columns:")
-            for col in columns:
-                print(f"  - {col[1]} ({col[2]}) {'PRIMARY KEY' if col[5] else ''}")
+            table_columns[table_name] = [col[0] for col in columns]
+            out("Columns:")
+            for col_name, col_type, pk in columns:
+                out(f"  - {col_name} ({col_type}) {'PRIMARY KEY' if pk else ''}")
             
             # Get row count
             cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
             count = cursor.fetchone()[0]
-            print(f"Row count: {count}")
+            out(f"Row count: {count}")
             
             # Show sample data (first 5 rows)
             if count > 0:
                 cursor.execute(f"SELECT * FROM {table_name} LIMIT 5;")
                 sample_data = cursor.fetchall()
-                print("Sample data (first 5 rows):")
+                out("Sample data (first 5 rows):")
                 for i, row in enumerate(sample_data, 1):
-                    print(f"  Row {i}: {row}")
+                    out(f"  Row {i}: {row}")
             
-            print()
+            out("")
         
         # 3. Specific queries for CacheEntry table if it exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='CacheEntry';")
-        if cursor.fetchone():
-            print("🎯 CacheEntry Analysis")
-            print("-" * 40)
-            
-            # Get unique keys (URLs)
-            cursor.execute("SELECT DISTINCT key FROM CacheEntry WHERE key IS NOT NULL;")
-            unique_keys = cursor.fetchall()
-            print(f"Unique URLs/Keys: {len(unique_keys)}")
-            for key, in unique_keys[:10]:  # Show first 10
-                print(f"  - {key}")
-            if len(unique_keys) > 10:
-                print(f"  ... and {len(unique_keys) - 10} more")
+        if 'CacheEntry' in table_columns:
+            out("🎯 CacheEntry Analysis")
+            out("-" * 40)
             
-            print()
+            # Get unique GUIDs (one per watched URL); only the first 10 are listed
+            cursor.execute("SELECT COUNT(DISTINCT guid) FROM CacheEntry;")
+            unique_count = cursor.fetchone()[0]
+            cursor.execute("SELECT DISTINCT guid FROM CacheEntry WHERE guid IS NOT NULL LIMIT 10;")
+            out(f"Unique URLs/GUIDs: {unique_count}")
+            for guid, in cursor.fetchall():
+                out(f"  - {guid}")
+            if unique_count > 10:
+                out(f"  ... and {unique_count - 10} more")
             
-            # Check if timestamp column exists
-            cursor.execute("PRAGMA table_info(CacheEntry);")
-            columns = [col[1] for col in cursor.fetchall()]
+            out("")
             
+            columns = table_columns['CacheEntry']
             if 'timestamp' in columns:
-                print("⏰ Timestamp analysis:")
-                cursor.execute("SELECT key, timestamp FROM CacheEntry WHERE timestamp IS NOT NULL ORDER BY timestamp DESC LIMIT 5;")
+                out("⏰ Timestamp analysis:")
+                cursor.execute("SELECT guid, timestamp FROM CacheEntry WHERE timestamp IS NOT NULL ORDER BY timestamp DESC LIMIT 5;")
                 recent = cursor.fetchall()
-                for key, ts in recent:
+                for guid, ts in recent:
                     try:
                         dt = datetime.fromtimestamp(ts)
-                        print(f"  {dt.strftime('%Y-%m-%d %H:%M:%S')} - {key}")
+                        out(f"  {dt.strftime('%Y-%m-%d %H:%M:%S')} - {guid}")
                     except:
-                        print(f"  Invalid timestamp {ts} - {key}")
+                        out(f"  Invalid timestamp {ts} - {guid}")
             else:
-                print("⏰ No timestamp column found")
+                out("⏰ No timestamp column found")
                 
                 # Show most recent entries by rowid
-                cursor.execute("SELECT key, rowid FROM CacheEntry ORDER BY rowid DESC LIMIT 5;")
+                cursor.execute("SELECT guid, rowid FROM CacheEntry ORDER BY rowid DESC LIMIT 5;")
                 recent = cursor.fetchall()
-                print("Most recent entries (by rowid):")
-                for key, rowid in recent:
-                    print(f"  Entry #{rowid} - {key}")
+                out("Most recent entries (by rowid):")
+                for guid, rowid in recent:
+                    out(f"  Entry #{rowid} - {guid}")
         
     except sqlite3.Error as e:
-        print(f"❌ Database error: {e}")
+        out(f"❌ Database error: {e}")
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+        parts.append("")
+        sys.stdout.write("\n".join(parts))
+        sys.stdout.flush()
 
 def suggest_fixes():
     """Suggest fixes based on database structure."""
@@ -1,6 +1,11 @@
 import yaml
 import os
 
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
 def extract_jobs():
     """
     Lee urls2watch.yaml y genera los archivos .urlwatch/urls.yaml y .urlwatch/config.yaml
@@ -14,7 +19,7 @@ def extract_jobs():
         return
 
     with open('urls2watch.yaml', 'r', encoding='utf-8') as f:
-        data = yaml.safe_load(f)
+        data = yaml.load(f, Loader=_Loader)
 
     if not isinstance(data, dict):
         print("⚠️ Formato invalido en urls2watch.yaml")
@@ -24,7 +29,8 @@ def extract_jobs():
 
     # Guardar urls.yaml para urlwatch
     with open('.urlwatch/urls.yaml', 'w', encoding='utf-8') as f:
-        yaml.dump_all(jobs, f, default_flow_style=False, allow_unicode=True)
+        yaml.dump_all(jobs, f, Dumper=_Dumper, default_flow_style=False,
+                      allow_unicode=True, explicit_start=True)
 
     # Guardar config.yaml para urlwatch
     config = {
@@ -35,7 +41,7 @@ def extract_jobs():
     }
 
     with open('.urlwatch/config.yaml', 'w', encoding='utf-8') as f:
-        yaml.dump(config, f, default_flow_style=False)
+        yaml.dump(config, f, Dumper=_Dumper, default_flow_style=False)
 
     print(f"✅ Extraidos {len(jobs)} trabajos a .urlwatch/urls.yaml")
 
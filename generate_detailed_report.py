@@ -4,165 +4,283 @@ Script para generar reportes detallados de URLWatch
 Muestra información de fechas de último cambio y estado de URLs
 """
 
+import hashlib
 import sqlite3
 import os
 import sys
 from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
+from pprint import pformat
 
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+# Consultas SQL reutilizadas: el texto idéntico permite a sqlite3 reutilizar
+# la sentencia preparada de su caché
+
+def _sql_format_timestamp(ts):
+    """Expresión SQL equivalente a format_timestamp() para la columna/expresión `ts`"""
+    # Mismos casos que en Python: vacío (NULL, 0, '') -> 'Sin datos'; no
+    # numérico o fuera del rango de datetime -> 'Fecha inválida'. strftime()
+    # devuelve NULL pasado el año 9999; por abajo, fromtimestamp() también
+    # exige que la hora local de un día antes (su comprobación de fold) sea
+    # del año 1 o posterior
+    return f"""CASE
+               WHEN {ts} IS NULL OR {ts} = 0 OR length({ts}) = 0 THEN 'Sin datos'
+               WHEN typeof({ts}) IN ('integer', 'real')
+                    AND strftime('%Y', {ts} - 86400, 'unixepoch', 'localtime') > '0000'
+                   THEN COALESCE(strftime('%d/%m/%Y %H:%M:%S', {ts}, 'unixepoch', 'localtime'),
+                                 'Fecha inválida')
+               ELSE 'Fecha inválida'
+           END"""
+
+# Las 5 entradas más recientes de cada GUID, con la fecha ya formateada
+_Q_REPORT = f"""
+    SELECT guid,
+           {_sql_format_timestamp('timestamp')} as ts_fmt,
+           tries, etag, ok
+    FROM (
+        SELECT guid, timestamp, tries, etag,
+               (data IS NOT NULL) as ok,
+               ROW_NUMBER() OVER (PARTITION BY guid ORDER BY timestamp DESC) as rn
+        FROM CacheEntry
+    )
+    WHERE rn <= 5
+    ORDER BY guid, rn
+"""
+
+# Último cambio exitoso (data no es NULL) de cada GUID
+_Q_LAST_SUCCESSFUL = f"""
+    SELECT guid, {_sql_format_timestamp('MAX(timestamp)')}
+    FROM CacheEntry
+    WHERE data IS NOT NULL
+    GROUP BY guid
+"""
+
+_Q_STATS_CACHED = "SELECT total, unique_guids, min_ts, max_ts FROM cache_stats"
+_Q_STATS = """
+    SELECT COUNT(*), COUNT(DISTINCT guid), MIN(timestamp), MAX(timestamp)
+    FROM CacheEntry
+"""
+
+@lru_cache(maxsize=None)
 def get_urlwatch_db_path():
     """Obtiene la ruta de la base de datos de URLWatch"""
-    home = Path.home()
-    cache_dir = home / ".cache" / "urlwatch"
-    db_path = cache_dir / "cache.db"
-    
-    if not db_path.exists():
-        # Intentar otras ubicaciones posibles
-        alt_paths = [
-            home / ".config" / "urlwatch" / "cache.db",
-            Path("./cache.db"),
-            Path("./logs/cache.db")
-        ]
-        
-        for alt_path in alt_paths:
-            if alt_path.exists():
-                return alt_path
-        
-        print(f"❌ No se encontró la base de datos de URLWatch")
-        print(f"Rutas buscadas:")
-        print(f"  - {db_path}")
-        for alt_path in alt_paths:
-            print(f"  - {alt_path}")
-        return None
+    db_path = os.path.expanduser("~/.cache/urlwatch/cache.db")
+    
+    # Un solo stat() para la ubicación habitual
+    try:
+        os.stat(db_path)
+        return Path(db_path)
+    except OSError:
+        pass
+    
+    # Intentar otras ubicaciones posibles
+    alt_paths = [
+        os.path.expanduser("~/.config/urlwatch/cache.db"),
+        "./cache.db",
+        "./logs/cache.db"
+    ]
+    
+    for alt_path in alt_paths:
+        if os.path.exists(alt_path):
+            return Path(alt_path)
     
-    return db_path
+    print(f"❌ No se encontró la base de datos de URLWatch")
+    print(f"Rutas buscadas:")
+    print(f"  - {db_path}")
+    for alt_path in alt_paths:
+        print(f"  - {alt_path}")
+    return None
 
-def format_timestamp(timestamp):
+def connect_readonly(db_path):
+    """Abre la base de datos de URLWatch en modo solo lectura"""
+    # Autocommit: sin BEGIN/COMMIT implícitos alrededor de las consultas
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True,
+                           cached_statements=256, isolation_level=None)
+    
+    # Ajustes para consultas de solo lectura: sin escrituras, temporales en
+    # memoria, lecturas vía mmap y una caché de páginas de 64 MiB
+    conn.executescript("""
+        PRAGMA query_only=1;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+    """)
+    return conn
+
+_fromtimestamp = datetime.fromtimestamp
+
+def format_timestamp(timestamp, _fromts=_fromtimestamp):
     """Convierte timestamp a fecha legible"""
-    if timestamp:
+    if not timestamp:
+        return "Sin datos"
+    if isinstance(timestamp, (int, float)):
         try:
-            return datetime.fromtimestamp(timestamp).strftime("%d/%m/%Y %H:%M:%S")
-        except:
-            return "Fecha inválida"
-    return "Sin datos"
+            return _fromts(timestamp).strftime("%d/%m/%Y %H:%M:%S")
+        except (OverflowError, OSError, ValueError):
+            pass
+    return "Fecha inválida"
+
+def iter_rows(cursor, size=500):
+    """Recorre los resultados de un cursor por bloques de `size` filas"""
+    while True:
+        chunk = cursor.fetchmany(size)
+        if not chunk:
+            break
+        yield from chunk
+
+def parse_job_info(raw):
+    """Genera el mapa guid -> {name, url} a partir del contenido de urls2watch.yaml"""
+    config = yaml.load(raw, Loader=_Loader)
+    
+    # Generar GUIDs de la misma manera que urlwatch
+    return {
+        hashlib.sha1(job['url'].encode()).hexdigest(): {
+            'name': job.get('name', job['url']),
+            'url': job['url']
+        }
+        for job in config.get('jobs', []) if 'url' in job
+    }
 
+@lru_cache(maxsize=1)
 def get_job_info():
     """Obtiene información de los jobs desde urls2watch.yaml"""
-    import yaml
-    import hashlib
-    
     jobs_info = {}
     
     try:
-        # Leer el archivo YAML de configuración
-        with open('urls2watch.yaml', 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-        
-        # Extraer los jobs y generar GUIDs consistentes
-        if 'jobs' in config:
-            for job in config['jobs']:
-                if 'url' in job:
-                    # Generar GUID de la misma manera que urlwatch
-                    url = job['url']
-                    guid = hashlib.sha1(url.encode()).hexdigest()
-                    
-                    jobs_info[guid] = {
-                        'name': job.get('name', url),
-                        'url': url
-                    }
-                    
+        # Leer el archivo YAML de configuración (libyaml decodifica los bytes)
+        with open('urls2watch.yaml', 'rb') as f:
+            raw = f.read()
+        
+        # Mapa precalculado con --freeze, válido mientras el YAML no cambie
+        try:
+            from jobs_info_cache import JOBS_INFO, SOURCE_SHA1
+            if hashlib.sha1(raw).hexdigest() == SOURCE_SHA1:
+                return JOBS_INFO
+        except ImportError:
+            pass
+        
+        jobs_info = parse_job_info(raw)
+        
     except FileNotFoundError:
         print("⚠️ Advertencia: No se encontró urls2watch.yaml")
     except Exception as e:
         print(f"❌ Error leyendo urls2watch.yaml: {e}")
     
     return jobs_info
-def generate_detailed_report():
-    """Genera un reporte detallado con fechas de cambio"""
+
+def freeze_job_info():
+    """Guarda el mapa de jobs precalculado en jobs_info_cache.py"""
+    cache_file = Path(__file__).with_name("jobs_info_cache.py")
     
-    db_path = get_urlwatch_db_path()
-    if not db_path:
+    try:
+        with open('urls2watch.yaml', 'rb') as f:
+            raw = f.read()
+        jobs_info = parse_job_info(raw)
+    except FileNotFoundError:
+        print("⚠️ Advertencia: No se encontró urls2watch.yaml")
         return
+    except Exception as e:
+        print(f"❌ Error leyendo urls2watch.yaml: {e}")
+        return
+    
+    with open(cache_file, 'w', encoding='utf-8') as f:
+        f.write(
+            "# Generado por generate_detailed_report.py --freeze; no editar\n"
+            f"SOURCE_SHA1 = {hashlib.sha1(raw).hexdigest()!r}\n\n"
+            f"JOBS_INFO = {pformat(jobs_info)}\n"
+        )
+    
+    print(f"✅ {len(jobs_info)} jobs guardados en: {cache_file}")
+
+def generate_detailed_report(conn=None):
+    """Genera un reporte detallado con fechas de cambio"""
+    
+    own_conn = conn is None
+    if own_conn:
+        db_path = get_urlwatch_db_path()
+        if not db_path:
+            return
     
     try:
-        conn = sqlite3.connect(str(db_path))
+        if own_conn:
+            conn = connect_readonly(db_path)
         cursor = conn.cursor()
         
-        # Obtener información de la base de datos
-        cursor.execute("""
-            SELECT guid, timestamp, tries, etag, 
-                   CASE WHEN data IS NULL THEN 'ERROR' ELSE 'OK' END as status
-            FROM CacheEntry 
-            ORDER BY guid, timestamp DESC
-        """)
+        cursor.execute(_Q_LAST_SUCCESSFUL)
+        last_successful_by_guid = dict(cursor.fetchall())
         
-        results = cursor.fetchall()
-        jobs_info = get_job_info()
+        # Las filas se leen por bloques a medida que se genera el reporte
+        cursor.execute(_Q_REPORT)
+        results = iter_rows(cursor)
         
-        print("=" * 80)
-        print("📊 REPORTE DETALLADO DE URLWATCH")
-        print(f"🕐 Generado: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
-        print("=" * 80)
-        print()
+        jobs_info = get_job_info()
         
-        # Agrupar resultados por GUID
-        guid_data = {}
-        for row in results:
-            guid, timestamp, tries, etag, status = row
-            if guid not in guid_data:
-                guid_data[guid] = []
-            guid_data[guid].append({
-                'timestamp': timestamp,
-                'tries': tries,
-                'etag': etag,
-                'status': status
-            })
+        # Acumular el reporte y escribirlo de una sola vez
+        parts = [
+            "=" * 80,
+            "📊 REPORTE DETALLADO DE URLWATCH",
+            f"🕐 Generado: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}",
+            "=" * 80,
+            "",
+        ]
         
-        # Generar reporte para cada job
-        for guid, entries in guid_data.items():
+        # Generar reporte para cada job (las filas ya vienen agrupadas por GUID)
+        for guid, rows in groupby(results, key=itemgetter(0)):
+            entries = list(rows)
             job_info = jobs_info.get(guid, {
                 "name": f"Job desconocido ({guid[:8]}...)",
                 "url": "URL desconocida"
             })
             
-            print(f"🔍 {job_info['name']}")
-            print(f"🌐 {job_info['url']}")
+            parts.append(f"🔍 {job_info['name']}")
+            parts.append(f"🌐 {job_info['url']}")
             
             if entries:
-                latest = entries[0]
-                print(f"📅 Última verificación: {format_timestamp(latest['timestamp'])}")
-                print(f"✅ Estado: {latest['status']}")
-                print(f"🔄 Intentos: {latest['tries']}")
-                
-                # Buscar el último cambio exitoso (cuando data no es NULL)
-                last_successful = None
-                for entry in entries:
-                    if entry['status'] == 'OK':
-                        last_successful = entry
-                        break
+                _, ts_fmt, tries, _, ok = entries[0]
+                parts.append(f"📅 Última verificación: {ts_fmt}")
+                parts.append(f"✅ Estado: {'OK' if ok else 'ERROR'}")
+                parts.append(f"🔄 Intentos: {tries}")
                 
+                last_successful = last_successful_by_guid.get(guid)
                 if last_successful:
-                    print(f"📝 Último cambio exitoso: {format_timestamp(last_successful['timestamp'])}")
+                    parts.append(f"📝 Último cambio exitoso: {last_successful}")
                 else:
-                    print("📝 Último cambio exitoso: Sin datos disponibles")
+                    parts.append("📝 Último cambio exitoso: Sin datos disponibles")
                     
-                # Mostrar historial reciente
+                # Mostrar historial reciente (últimas 5 entradas)
                 if len(entries) > 1:
-                    print("📊 Historial reciente:")
-                    for i, entry in enumerate(entries[:5]):  # Mostrar últimas 5 entradas
-                        status_icon = "✅" if entry['status'] == 'OK' else "❌"
-                        print(f"   {i+1}. {format_timestamp(entry['timestamp'])} {status_icon} ({entry['tries']} intentos)")
+                    parts.append("📊 Historial reciente:")
+                    for i, (_, ts_fmt, tries, _, ok) in enumerate(entries):
+                        status_icon = "✅" if ok else "❌"
+                        parts.append(f"   {i+1}. {ts_fmt} {status_icon} ({tries} intentos)")
             else:
-                print("❌ Sin datos disponibles")
+                parts.append("❌ Sin datos disponibles")
             
-            print("-" * 60)
-            print()
+            parts.append("-" * 60)
+            parts.append("")
         
-        conn.close()
+        parts.append("")
+        report_text = "\n".join(parts)
+        sys.stdout.write(report_text)
+        sys.stdout.flush()
+        
+        if own_conn:
+            conn.close()
         
-        # Guardar reporte en archivo
+        # Guardar reporte en archivo con una única escritura
         report_file = f"logs/detailed_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
         os.makedirs("logs", exist_ok=True)
+        with open(report_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+            f.write(report_text)
         
         print(f"💾 Reporte guardado en: {report_file}")
         
@@ -171,24 +289,147 @@ def generate_detailed_report():
     except Exception as e:
         print(f"❌ Error inesperado: {e}")
 
-def show_cache_stats():
-    """Muestra estadísticas de la cache"""
+def create_indexes():
+    """Crea en la cache de URLWatch los índices que aceleran los reportes"""
     db_path = get_urlwatch_db_path()
     if not db_path:
         return
+    
+    try:
+        conn = sqlite3.connect(str(db_path))
+        
+        # Índice compuesto para las consultas por GUID ordenadas por fecha; el
+        # parcial cubre "último exitoso" y el de timestamp resuelve MIN/MAX
+        # globales (los triggers de cache_stats) con una búsqueda en el índice
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_cacheentry_guid_ts
+                ON CacheEntry(guid, timestamp DESC);
+            CREATE INDEX IF NOT EXISTS idx_cacheentry_ok_guid_ts
+                ON CacheEntry(guid, timestamp) WHERE data IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS idx_cacheentry_ts
+                ON CacheEntry(timestamp);
+            ANALYZE;
+        """)
         
+        # Tabla de estadísticas mantenida por triggers: show_cache_stats()
+        # lee una sola fila en lugar de recorrer CacheEntry. Los triggers se
+        # recrean para que una cache existente reciba la versión actual; igual
+        # que COUNT/MIN/MAX, ignoran guid y timestamp NULL. Todos son
+        # incrementales: como mucho una búsqueda por índice por fila modificada
+        conn.executescript("""
+            DROP TRIGGER IF EXISTS cache_stats_insert;
+            DROP TRIGGER IF EXISTS cache_stats_delete;
+            DROP TRIGGER IF EXISTS cache_stats_update;
+            
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total INTEGER,
+                unique_guids INTEGER,
+                min_ts INTEGER,
+                max_ts INTEGER
+            );
+            INSERT OR REPLACE INTO cache_stats
+                SELECT 1, COUNT(*), COUNT(DISTINCT guid), MIN(timestamp), MAX(timestamp)
+                FROM CacheEntry;
+            
+            CREATE TRIGGER cache_stats_insert AFTER INSERT ON CacheEntry
+            BEGIN
+                UPDATE cache_stats SET
+                    total = total + 1,
+                    unique_guids = unique_guids + (NEW.guid IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM CacheEntry WHERE guid = NEW.guid AND id != NEW.id)),
+                    min_ts = MIN(COALESCE(min_ts, NEW.timestamp), COALESCE(NEW.timestamp, min_ts)),
+                    max_ts = MAX(COALESCE(max_ts, NEW.timestamp), COALESCE(NEW.timestamp, max_ts))
+                WHERE id = 1;
+            END;
+            
+            CREATE TRIGGER cache_stats_delete AFTER DELETE ON CacheEntry
+            BEGIN
+                UPDATE cache_stats SET
+                    total = total - 1,
+                    unique_guids = unique_guids - (OLD.guid IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM CacheEntry WHERE guid = OLD.guid)),
+                    min_ts = CASE WHEN OLD.timestamp <= min_ts
+                                  THEN (SELECT MIN(timestamp) FROM CacheEntry)
+                                  ELSE min_ts END,
+                    max_ts = CASE WHEN OLD.timestamp >= max_ts
+                                  THEN (SELECT MAX(timestamp) FROM CacheEntry)
+                                  ELSE max_ts END
+                WHERE id = 1;
+            END;
+            
+            CREATE TRIGGER cache_stats_update
+            AFTER UPDATE OF guid, timestamp ON CacheEntry
+            BEGIN
+                UPDATE cache_stats SET
+                    unique_guids = unique_guids
+                        + (NEW.guid IS NOT OLD.guid AND NEW.guid IS NOT NULL AND NOT EXISTS (
+                            SELECT 1 FROM CacheEntry WHERE guid = NEW.guid AND id != NEW.id))
+                        - (NEW.guid IS NOT OLD.guid AND OLD.guid IS NOT NULL AND NOT EXISTS (
+                            SELECT 1 FROM CacheEntry WHERE guid = OLD.guid)),
+                    min_ts = CASE WHEN NEW.timestamp IS NOT OLD.timestamp
+                                  THEN (SELECT MIN(timestamp) FROM CacheEntry)
+                                  ELSE min_ts END,
+                    max_ts = CASE WHEN NEW.timestamp IS NOT OLD.timestamp
+                                  THEN (SELECT MAX(timestamp) FROM CacheEntry)
+                                  ELSE max_ts END
+                WHERE id = 1;
+            END;
+        """)
+        conn.close()
+        
+        print(f"✅ Índices y estadísticas creados en: {db_path}")
+        
+    except sqlite3.Error as e:
+        print(f"❌ Error creando índices: {e}")
+
+def drop_indexes():
+    """Elimina de la cache de URLWatch todo lo creado por create_indexes()"""
+    db_path = get_urlwatch_db_path()
+    if not db_path:
+        return
+    
     try:
         conn = sqlite3.connect(str(db_path))
-        cursor = conn.cursor()
+        # sqlite_stat1 lo crea el ANALYZE de create_indexes(); urlwatch no lo usa
+        conn.executescript("""
+            DROP TRIGGER IF EXISTS cache_stats_insert;
+            DROP TRIGGER IF EXISTS cache_stats_delete;
+            DROP TRIGGER IF EXISTS cache_stats_update;
+            DROP TABLE IF EXISTS cache_stats;
+            DROP INDEX IF EXISTS idx_cacheentry_guid_ts;
+            DROP INDEX IF EXISTS idx_cacheentry_ok_guid_ts;
+            DROP INDEX IF EXISTS idx_cacheentry_ts;
+            DROP TABLE IF EXISTS sqlite_stat1;
+        """)
+        conn.close()
+        
+        print(f"✅ Índices y estadísticas eliminados de: {db_path}")
         
-        cursor.execute("SELECT COUNT(*) FROM CacheEntry")
-        total_entries = cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"❌ Error eliminando índices: {e}")
+
+def show_cache_stats(conn=None):
+    """Muestra estadísticas de la cache"""
+    own_conn = conn is None
+    if own_conn:
+        db_path = get_urlwatch_db_path()
+        if not db_path:
+            return
         
-        cursor.execute("SELECT COUNT(DISTINCT guid) FROM CacheEntry")
-        unique_jobs = cursor.fetchone()[0]
+    try:
+        if own_conn:
+            conn = connect_readonly(db_path)
+        cursor = conn.cursor()
         
-        cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM CacheEntry")
-        min_ts, max_ts = cursor.fetchone()
+        try:
+            # Estadísticas precalculadas (creadas con --create-index)
+            cursor.execute(_Q_STATS_CACHED)
+            total_entries, unique_jobs, min_ts, max_ts = cursor.fetchone()
+        except (sqlite3.OperationalError, TypeError):
+            # Todas las estadísticas en una sola pasada sobre la tabla
+            cursor.execute(_Q_STATS)
+            total_entries, unique_jobs, min_ts, max_ts = cursor.fetchone()
         
         print("📈 ESTADÍSTICAS DE CACHE")
         print(f"📝 Total de entradas: {total_entries}")
@@ -196,7 +437,8 @@ def show_cache_stats():
         print(f"📅 Período: {format_timestamp(min_ts)} - {format_timestamp(max_ts)}")
         print()
         
-        conn.close()
+        if own_conn:
+            conn.close()
         
     except sqlite3.Error as e:
         print(f"❌ Error: {e}")
@@ -205,8 +447,25 @@ if __name__ == "__main__":
     print("🔍 URLWatch - Generador de Reportes Detallados")
     print()
     
-    if len(sys.argv) > 1 and sys.argv[1] == "--stats":
-        show_cache_stats()
+    if len(sys.argv) > 1 and sys.argv[1] == "--create-index":
+        # Modifica cache.db: solo bajo petición explícita
+        create_indexes()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--drop-index":
+        # Deja cache.db como lo creó urlwatch
+        drop_indexes()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--freeze":
+        freeze_job_info()
     else:
-        generate_detailed_report()
-        show_cache_stats()
+        # Una sola conexión compartida por el reporte y las estadísticas
+        db_path = get_urlwatch_db_path()
+        if db_path:
+            try:
+                conn = connect_readonly(db_path)
+            except sqlite3.Error as e:
+                print(f"❌ Error accediendo a la base de datos: {e}")
+                sys.exit(1)
+            
+            if not (len(sys.argv) > 1 and sys.argv[1] == "--stats"):
+                generate_detailed_report(conn)
+            show_cache_stats(conn)
+            conn.close()
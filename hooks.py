@@ -3,70 +3,287 @@
 URLWatch Hooks - Captura información adicional sobre cambios
 Archivo: ~/.config/urlwatch/hooks.py
 """
+import atexit
 import json
 import os
 import hashlib
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Número máximo de cambios guardados por URL
+MAX_CHANGES = 50
+
+# Formato de las fechas legibles del historial y los reportes
+READABLE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# Segundos durante los que no se vuelve a registrar un contenido idéntico
+SAME_CONTENT_INTERVAL = 3600
+
+# Icono de cada tipo de actividad en status_summary.md
+_ACTIVITY_ICONS = {'new': '🆕', 'changed': '🔄', 'error': '❌', 'processed': '⚙️', 'unchanged': '✅'}
+
+# Bloques por sitio de status_summary.md (formato código y formato legible)
+_SITE_BLOCK = (
+    "=" * 80 + "\n"
+    "🔍 {name}\n"
+    "🌐 [{url}]({url})\n"
+    "📅 Última verificación: {exec_time}\n"
+    "✅ Estado: ✅ OK\n"
+    "📏 Último cambio: {last_change}\n"
+    "🔄 Última verificación sin cambios: {last_unchanged}\n"
+    "📊 Total cambios registrados: {total_changes}\n"
+    + "-" * 60 + "\n\n"
+)
+_SITE_SECTION = (
+    "### 🔍 {name}\n\n"
+    "- **URL:** [{url}]({url})\n"
+    "- **Última verificación:** {exec_time}\n"
+    "- **Estado:** ✅ OK\n"
+    "- **Último cambio:** {last_change}\n"
+    "- **Última verificación sin cambios:** {last_unchanged}\n"
+    "- **Total cambios registrados:** {total_changes}\n\n"
+)
+
+def dump_json(obj):
+    """Serializa a JSON indentado en bytes UTF-8 (orjson si está disponible)"""
+    # default=list convierte las deques del historial
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2, default=list)
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=list).encode('utf-8')
+
+def dump_json_line(obj):
+    """Serializa a una línea JSON compacta en bytes UTF-8, terminada en salto de línea"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8') + b"\n"
+
+@lru_cache(maxsize=None)
+def generate_guid(url):
+    """GUID de un job tal como lo calcula urlwatch (SHA-1 de la URL)"""
+    return hashlib.sha1(url.encode()).hexdigest()
+
+def load_json(data):
+    """Deserializa JSON desde bytes o str (orjson si está disponible)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 class ChangeTracker:
     """Clase para rastrear cambios detallados"""
     def __init__(self):
         self.log_dir = Path("logs")
         self.log_dir.mkdir(exist_ok=True)
         self.changes_file = self.log_dir / "changes_history.json"
-        self.load_history()
+        # Registro de cambios solo-añadir desde el último snapshot
+        self.events_file = self.log_dir / "changes_history.jsonl"
+        self._events_fh = None
+        # errors.log se abre una vez con buffer y se vuelca en flush()
+        self.errors_file = self.log_dir / "errors.log"
+        self._errors_fh = None
+        # Marca de tiempo compartida por los cambios de una ejecución
+        self._run_time = None
+        # Hay cambios en memoria que aún no están en el snapshot
+        self._dirty = False
+        # El historial se carga en el primer acceso, no al importar el módulo
+        self._history = None
+        # Consolidar lo pendiente aunque urlwatch no llegue a los hooks finales
+        atexit.register(self.flush)
+    
+    @property
+    def history(self):
+        """Historial por GUID, cargado bajo demanda"""
+        if self._history is None:
+            self._load()
+        return self._history
     
-    def load_history(self):
-        """Carga el historial de cambios"""
+    def _load(self):
+        """Carga el historial de cambios (snapshot + eventos pendientes)"""
         try:
             if self.changes_file.exists():
-                with open(self.changes_file, 'r', encoding='utf-8') as f:
-                    self.history = json.load(f)
+                self._history = load_json(self.changes_file.read_bytes())
             else:
-                self.history = {}
-        except:
-            self.history = {}
+                self._history = {}
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error cargando historial: {e}")
+            self._history = {}
+        
+        # Los cambios se mantienen en memoria como deque acotada
+        for data in self._history.values():
+            data['changes'] = deque(data.get('changes', []), maxlen=MAX_CHANGES)
+            
+            # Historiales anteriores a los marcadores: calcularlos una vez
+            if 'last_unchanged_readable' not in data:
+                data['last_unchanged_readable'] = None
+                data['last_successful_readable'] = None
+                for change in data['changes']:
+                    self._update_markers(data, change)
+        
+        # Reaplicar los cambios registrados después del último snapshot
+        try:
+            with open(self.events_file, 'rb') as f:
+                for line in f:
+                    try:
+                        self._apply_event(load_json(line))
+                        self._dirty = True
+                    except ValueError:
+                        # Línea incompleta por una ejecución interrumpida
+                        continue
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error cargando eventos de historial: {e}")
     
     def save_history(self):
-        """Guarda el historial de cambios"""
+        """Guarda un snapshot compacto del historial y vacía el registro de eventos"""
         try:
-            with open(self.changes_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, indent=2, ensure_ascii=False)
+            # Escribir en un temporal y renombrar: un fallo a mitad de
+            # escritura nunca deja el snapshot truncado
+            tmp_file = self.changes_file.with_suffix(".json.tmp")
+            # El registro de eventos es la única otra copia de esta ejecución:
+            # si se va a borrar, el snapshot debe ser durable antes (fsync del
+            # temporal y del directorio tras el rename). Sin eventos pendientes
+            # no hay nada que perder y se evita el coste del fsync
+            durable = self._events_fh is not None or self.events_file.exists()
+            with open(tmp_file, 'wb') as f:
+                f.write(dump_json(self.history))
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_file, self.changes_file)
+            if durable:
+                self._fsync_dir()
+            
+            # Los eventos ya están incluidos en el snapshot
+            if self._events_fh is not None:
+                self._events_fh.close()
+                self._events_fh = None
+            self.events_file.unlink(missing_ok=True)
+            
+            # La siguiente ejecución usará una nueva marca de tiempo
+            self._run_time = None
+            self._dirty = False
         except Exception as e:
             print(f"Error guardando historial: {e}")
     
-    def record_change(self, job_name, url, change_type, content_length=0):
-        """Registra un cambio usando GUIDs consistentes"""
-        timestamp = datetime.now().isoformat()
-        
-        # Generar GUID consistente
-        guid = hashlib.sha1(url.encode()).hexdigest()
+    def _fsync_dir(self):
+        """Hace durable el rename del snapshot (no disponible en todos los sistemas)"""
+        try:
+            fd = os.open(self.log_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
+    def flush(self):
+        """Guarda el snapshot solo si hay cambios pendientes y vuelca errors.log"""
+        if self._dirty:
+            self.save_history()
+        if self._errors_fh is not None:
+            self._errors_fh.flush()
+    
+    def log_error(self, line):
+        """Añade una línea a errors.log sin reabrir el archivo en cada error"""
+        if self._errors_fh is None:
+            self._errors_fh = open(self.errors_file, 'a', encoding='utf-8', buffering=4096)
+        self._errors_fh.write(line)
+    
+    @staticmethod
+    def _update_markers(data, change):
+        """Actualiza las fechas de última verificación sin cambios / exitosa"""
+        change_type = change.get('type')
+        if change_type == 'unchanged':
+            data['last_unchanged_readable'] = change.get('readable_date', 'Fecha no disponible')
+        elif change_type in ('processed', 'new') and change.get('content_length', 0) > 0:
+            data['last_successful_readable'] = change.get('readable_date', 'Fecha no disponible')
+    
+    def _apply_event(self, event):
+        """Aplica un cambio registrado al historial en memoria"""
+        guid = event.pop('guid')
+        job_name = event.pop('name')
+        url = event.pop('url')
+        content_hash = event.pop('content_hash', None)
         
         if guid not in self.history:
             self.history[guid] = {
                 'name': job_name,
                 'url': url,
-                'first_seen': timestamp,
-                'changes': []
+                'first_seen': event['timestamp'],
+                'changes': deque(maxlen=MAX_CHANGES),
+                'last_unchanged_readable': None,
+                'last_successful_readable': None
             }
         
-        change_record = {
+        # La deque descarta sola los cambios más antiguos
+        self.history[guid]['changes'].append(event)
+        self.history[guid]['last_change'] = event['timestamp']
+        self.history[guid]['last_change_readable'] = event['readable_date']
+        self._update_markers(self.history[guid], event)
+        # Solo se descarta contenido repetido si el último evento fue ese mismo
+        # contenido: un evento sin huella (p. ej. un error) la invalida
+        self.history[guid]['last_hash'] = content_hash
+    
+    def _timestamps(self):
+        """Devuelve (ISO, legible) de la ejecución actual"""
+        if self._run_time is None:
+            now = datetime.now()
+            self._run_time = (now.isoformat(), now.strftime(READABLE_FORMAT))
+        return self._run_time
+    
+    def record_change(self, job_name, url, change_type, content_length=0, content_hash=None):
+        """Registra un cambio usando GUIDs consistentes"""
+        timestamp, readable_date = self._timestamps()
+        
+        # Generar GUID consistente (memorizado: las URLs se repiten)
+        guid = generate_guid(url)
+        
+        # Cargar el historial antes de añadir al registro de eventos: si se
+        # cargara después, la reproducción del registro incluiría este mismo
+        # evento y _apply_event lo añadiría por segunda vez
+        history = self.history
+        
+        # Mismo contenido que el último registrado: como mucho un registro por hora
+        if content_hash is not None:
+            data = history.get(guid)
+            if data is not None and data.get('last_hash') == content_hash:
+                elapsed = datetime.fromisoformat(timestamp) - datetime.fromisoformat(data['last_change'])
+                if elapsed.total_seconds() < SAME_CONTENT_INTERVAL:
+                    return
+        
+        event = {
+            'guid': guid,
+            'name': job_name,
+            'url': url,
             'timestamp': timestamp,
             'type': change_type,  # 'new', 'changed', 'error', 'unchanged'
             'content_length': content_length,
-            'readable_date': datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            'readable_date': readable_date
         }
+        if content_hash is not None:
+            event['content_hash'] = content_hash
         
-        self.history[guid]['changes'].append(change_record)
-        self.history[guid]['last_change'] = timestamp
-        self.history[guid]['last_change_readable'] = change_record['readable_date']
-        
-        # Mantener solo los últimos 50 cambios
-        if len(self.history[guid]['changes']) > 50:
-            self.history[guid]['changes'] = self.history[guid]['changes'][-50:]
+        # Añadir una línea al registro en lugar de reescribir todo el historial;
+        # el snapshot completo se guarda una vez por ejecución
+        try:
+            if self._events_fh is None:
+                self._events_fh = open(self.events_file, 'ab')
+            self._events_fh.write(dump_json_line(event))
+            self._events_fh.flush()
+        except Exception as e:
+            print(f"Error registrando cambio: {e}")
         
-        self.save_history()
+        self._apply_event(event)
+        self._dirty = True
 
 # Instancia global del tracker
 change_tracker = ChangeTracker()
@@ -79,14 +296,24 @@ def filter_result(url, job, result):
     """
     try:
         job_name = getattr(job, 'name', 'Unnamed Job')
-        content_length = len(result) if result else 0
+        # Solo texto/bytes: len() es O(1) y no se invoca __len__ de otros objetos
+        if isinstance(result, (str, bytes, bytearray)):
+            content_length = len(result)
+            raw = result.encode('utf-8', 'surrogatepass') if isinstance(result, str) else result
+            # Huella rápida de 64 bits para detectar contenido repetido
+            content_hash = hashlib.blake2b(raw, digest_size=8).hexdigest()
+        else:
+            content_length = 0
+            content_hash = None
         
-        # Este hook se llama siempre, registramos como 'processed'
+        # Este hook se llama siempre; se registra como 'processed' salvo que
+        # el contenido sea el mismo que el último registrado hace menos de una hora
         change_tracker.record_change(
             job_name,
             url,
             'processed',
-            content_length
+            content_length,
+            content_hash=content_hash
         )
         
         return result
@@ -94,33 +321,39 @@ def filter_result(url, job, result):
         print(f"Error en filter_result hook: {e}")
         return result
 
+def _summarize(job):
+    """Resumen de un job para execution_summary (una sola lectura de sus atributos)"""
+    # urlwatch guarda los campos del job (incluidos los opcionales) en la instancia
+    attrs = getattr(job, '__dict__', {})
+    return {
+        'name': attrs.get('name', 'Unnamed'),
+        'url': attrs.get('url', 'Unknown URL'),
+        'timeout': attrs.get('timeout', 30),
+        'filters': str(attrs.get('filter', [])),
+    }
+
 def job_list_finished(jobs):
     """
     Hook llamado cuando terminan todos los jobs
     Genera un resumen de la ejecución
     """
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Consolidar los cambios de esta ejecución en el snapshot
+        change_tracker.flush()
+        
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
         summary_file = change_tracker.log_dir / f"execution_summary_{timestamp}.json"
         
         execution_summary = {
-            'timestamp': datetime.now().isoformat(),
-            'readable_date': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            'timestamp': now.isoformat(),
+            'readable_date': now.strftime(READABLE_FORMAT),
             'total_jobs': len(jobs),
-            'jobs_summary': []
+            'jobs_summary': [_summarize(job) for job in jobs]
         }
         
-        for job in jobs:
-            job_summary = {
-                'name': getattr(job, 'name', 'Unnamed'),
-                'url': getattr(job, 'url', 'Unknown URL'),
-                'timeout': getattr(job, 'timeout', 30),
-                'filters': str(getattr(job, 'filter', [])),
-            }
-            execution_summary['jobs_summary'].append(job_summary)
-        
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(execution_summary, f, indent=2, ensure_ascii=False)
+        with open(summary_file, 'wb') as f:
+            f.write(dump_json(execution_summary))
             
     except Exception as e:
         print(f"Error en job_list_finished hook: {e}")
@@ -131,11 +364,15 @@ def report_finished(reports):
     Actualiza estadísticas finales y genera reporte mejorado
     """
     try:
+        # Consolidar cambios registrados después de job_list_finished
+        change_tracker.flush()
+        
         # Generar reporte de estado actual
+        now = datetime.now()
         status_file = change_tracker.log_dir / "current_status.json"
         current_status = {
-            'last_execution': datetime.now().isoformat(),
-            'last_execution_readable': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            'last_execution': now.isoformat(),
+            'last_execution_readable': now.strftime(READABLE_FORMAT),
             'monitored_sites': {}
         }
         
@@ -144,19 +381,11 @@ def report_finished(reports):
             changes = data.get('changes', [])
             last_change = data.get('last_change_readable', 'Sin cambios registrados')
             
-            # Encontrar la última vez que no hubo cambios (estado 'unchanged')
-            last_unchanged = 'No disponible'
-            for change in reversed(changes):
-                if change.get('type') == 'unchanged':
-                    last_unchanged = change.get('readable_date', 'Fecha no disponible')
-                    break
-            
-            # Si no hay 'unchanged', buscar el último 'processed' exitoso
-            if last_unchanged == 'No disponible':
-                for change in reversed(changes):
-                    if change.get('type') in ['processed', 'new'] and change.get('content_length', 0) > 0:
-                        last_unchanged = change.get('readable_date', 'Fecha no disponible')
-                        break
+            # Última vez sin cambios ('unchanged') o, si no hay, último
+            # 'processed'/'new' exitoso; ambos se mantienen en record_change
+            last_unchanged = (data.get('last_unchanged_readable')
+                              or data.get('last_successful_readable')
+                              or 'No disponible')
             
             url = data.get('url', guid)
             current_status['monitored_sites'][guid] = {
@@ -166,67 +395,59 @@ def report_finished(reports):
                 'last_change': last_change,
                 'last_unchanged': last_unchanged,
                 'total_changes': len(changes),
-                'recent_activity': changes[-3:] if changes else []
+                'recent_activity': list(changes)[-3:]
             }
         
         # Guardar estado actual en JSON
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump(current_status, f, indent=2, ensure_ascii=False)
+        with open(status_file, 'wb') as f:
+            f.write(dump_json(current_status))
         
         # Generar resumen legible en formato Markdown
         readable_status = change_tracker.log_dir / "status_summary.md"
-        with open(readable_status, 'w', encoding='utf-8') as f:
-            # Encabezado del reporte
-            f.write("# 📊 URLWatch Monitoring Summary\n\n")
-            f.write(f"**Generated:** {current_status['last_execution_readable']}\n")
-            f.write("**Status:** ✅ Monitoring completed successfully\n\n")
-            
-            # Sección de actividad reciente
-            f.write("## Recent Activity\n\n")
-            f.write("### Latest Execution Log\n")
-            f.write(f"`urlwatch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt`\n\n")
-            
-            # Sección de sitios monitoreados
-            f.write("## Monitored Sites\n\n")
-            f.write("### Detailed Status\n")
-            f.write("```\n")
-            
-            # Generar entrada para cada sitio
-            for guid, site_data in current_status['monitored_sites'].items():
-                f.write(f"================================================================================\n")
-                f.write(f"🔍 {site_data['name']}\n")
-                f.write(f"🌐 [{site_data['url']}]({site_data['url']})\n")
-                f.write(f"📅 Última verificación: {current_status['last_execution_readable']}\n")
-                f.write(f"✅ Estado: ✅ OK\n")
-                f.write(f"📏 Último cambio: {site_data['last_change']}\n")
-                f.write(f"🔄 Última verificación sin cambios: {site_data['last_unchanged']}\n")
-                f.write(f"📊 Total cambios registrados: {site_data['total_changes']}\n")
-                f.write("------------------------------------------------------------\n\n")
-            
-            f.write("```\n")
+        
+        # Construir todo el Markdown en memoria y escribirlo de una vez
+        parts = []
+        # Encabezado del reporte
+        parts.append("# 📊 URLWatch Monitoring Summary\n\n")
+        parts.append(f"**Generated:** {current_status['last_execution_readable']}\n")
+        parts.append("**Status:** ✅ Monitoring completed successfully\n\n")
+        
+        # Sección de actividad reciente
+        parts.append("## Recent Activity\n\n")
+        parts.append("### Latest Execution Log\n")
+        parts.append(f"`urlwatch_{now.strftime('%Y%m%d_%H%M%S')}.txt`\n\n")
+        
+        # Sección de sitios monitoreados
+        parts.append("## Monitored Sites\n\n")
+        parts.append("### Detailed Status\n")
+        parts.append("```\n")
+        
+        # Generar entrada para cada sitio
+        exec_time = current_status['last_execution_readable']
+        for site_data in current_status['monitored_sites'].values():
+            parts.append(_SITE_BLOCK.format(exec_time=exec_time, **site_data))
+        
+        parts.append("```\n")
+        
+        # Generar versión más legible sin formato de código
+        parts.append("\n## 📋 Detailed Status (Readable Format)\n\n")
+        
+        for site_data in current_status['monitored_sites'].values():
+            parts.append(_SITE_SECTION.format(exec_time=exec_time, **site_data))
             
-            # Generar versión más legible sin formato de código
-            f.write("\n## 📋 Detailed Status (Readable Format)\n\n")
+            # Mostrar actividad reciente si existe
+            if site_data['recent_activity']:
+                parts.append("**Actividad reciente:**\n")
+                for activity in site_data['recent_activity']:
+                    activity_type = activity.get('type', 'unknown')
+                    icon = _ACTIVITY_ICONS.get(activity_type, '❓')
+                    parts.append(f"  - {icon} {activity.get('readable_date', 'Fecha no disponible')} ({activity_type})\n")
+                parts.append("\n")
             
-            for guid, site_data in current_status['monitored_sites'].items():
-                f.write(f"### 🔍 {site_data['name']}\n\n")
-                f.write(f"- **URL:** [{site_data['url']}]({site_data['url']})\n")
-                f.write(f"- **Última verificación:** {current_status['last_execution_readable']}\n")
-                f.write(f"- **Estado:** ✅ OK\n")
-                f.write(f"- **Último cambio:** {site_data['last_change']}\n")
-                f.write(f"- **Última verificación sin cambios:** {site_data['last_unchanged']}\n")
-                f.write(f"- **Total cambios registrados:** {site_data['total_changes']}\n\n")
-                
-                # Mostrar actividad reciente si existe
-                if site_data['recent_activity']:
-                    f.write("**Actividad reciente:**\n")
-                    for activity in site_data['recent_activity']:
-                        activity_type = activity.get('type', 'unknown')
-                        icon = {'new': '🆕', 'changed': '🔄', 'error': '❌', 'processed': '⚙️', 'unchanged': '✅'}.get(activity_type, '❓')
-                        f.write(f"  - {icon} {activity.get('readable_date', 'Fecha no disponible')} ({activity_type})\n")
-                    f.write("\n")
-                
-                f.write("---\n\n")
+            parts.append("---\n\n")
+        
+        with open(readable_status, 'w', encoding='utf-8', buffering=1 << 16) as f:
+            f.write(''.join(parts))
         
         print(f"✅ Reporte generado: {readable_status}")
         
@@ -257,10 +478,8 @@ def job_failed(job, exception):
             0
         )
         
-        # Log del error
-        error_log = change_tracker.log_dir / "errors.log"
-        with open(error_log, 'a', encoding='utf-8') as f:
-            f.write(f"{datetime.now().isoformat()} - {job_name} ({job_url}): {str(exception)}\n")
-            
+        # Log del error (se vuelca en flush() o al salir)
+        change_tracker.log_error(f"{datetime.now().isoformat()} - {job_name} ({job_url}): {str(exception)}\n")
+        
     except Exception as e:
         print(f"Error en job_failed hook: {e}")
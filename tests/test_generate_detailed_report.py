@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Pruebas del formateo de fechas en SQL de generate_detailed_report.py
+"""
+import os
+import sqlite3
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import generate_detailed_report as gdr
+
+# Esquema de la tabla CacheEntry de urlwatch
+SCHEMA = """
+    CREATE TABLE CacheEntry (id INTEGER PRIMARY KEY, guid TEXT, timestamp INTEGER,
+                             data TEXT, tries INTEGER, etag TEXT)
+"""
+
+# Valores límite: vacíos, no numéricos, fuera de rango y fechas válidas. Las
+# fechas válidas anteriores al año 1000 se omiten: SQLite rellena el año con
+# ceros y el %Y de Python depende del strftime de la plataforma
+EDGE_TIMESTAMPS = [
+    None, 0, 0.0, -0.0, '', b'', 'garbage', '  ', b'\x01', '1758535067',
+    1758535067, 1758535067.9, -1, -62135596801, -62135596800,
+    253402300799, 253402300800, 1e20, float('inf'),
+]
+
+_saved_tz = None
+
+def setUpModule():
+    """Fija la zona horaria a UTC: fuera de 1970-2037 el 'localtime' de SQLite
+    no aplica los cambios históricos de desfase que sí aplica Python"""
+    global _saved_tz
+    if not hasattr(time, 'tzset'):
+        raise unittest.SkipTest("time.tzset() no disponible")
+    _saved_tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+
+def tearDownModule():
+    if _saved_tz is None:
+        os.environ.pop('TZ', None)
+    else:
+        os.environ['TZ'] = _saved_tz
+    time.tzset()
+
+class SqlFormatTimestampTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute(SCHEMA)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def insert(self, guid, timestamp, data='x', tries=1):
+        self.conn.execute(
+            "INSERT INTO CacheEntry (guid, timestamp, data, tries, etag) VALUES (?, ?, ?, ?, NULL)",
+            (guid, timestamp, data, tries)
+        )
+
+    def test_matches_format_timestamp(self):
+        """La expresión SQL da el mismo texto que format_timestamp() para cada valor almacenado"""
+        for value in EDGE_TIMESTAMPS:
+            self.insert('g', value)
+
+        query = f"SELECT timestamp, {gdr._sql_format_timestamp('timestamp')} FROM CacheEntry ORDER BY id"
+        for stored, formatted in self.conn.execute(query):
+            with self.subTest(timestamp=stored):
+                self.assertEqual(formatted, gdr.format_timestamp(stored))
+
+    def test_report_query_fallbacks(self):
+        """_Q_REPORT conserva 'Sin datos' y 'Fecha inválida' para 0, NULL y basura"""
+        self.insert('zero', 0)
+        self.insert('null', None)
+        self.insert('garbage', 'garbage')
+        self.insert('ok', 1758535067)
+
+        rows = {guid: ts_fmt for guid, ts_fmt, _, _, _ in self.conn.execute(gdr._Q_REPORT)}
+        self.assertEqual(rows['zero'], 'Sin datos')
+        self.assertEqual(rows['null'], 'Sin datos')
+        self.assertEqual(rows['garbage'], 'Fecha inválida')
+        self.assertEqual(rows['ok'], gdr.format_timestamp(1758535067))
+
+    def test_last_successful_query_fallbacks(self):
+        """_Q_LAST_SUCCESSFUL formatea el timestamp más reciente con los mismos casos"""
+        self.insert('null', None)
+        self.insert('garbage', 1758535067)
+        self.insert('garbage', 'garbage')
+        self.insert('failed', 1758535067, data=None)
+        self.insert('ok', 1758535000)
+        self.insert('ok', 1758535067)
+
+        rows = dict(self.conn.execute(gdr._Q_LAST_SUCCESSFUL))
+        self.assertEqual(rows['null'], 'Sin datos')
+        # Como en ORDER BY timestamp DESC, el texto se ordena después de los números
+        self.assertEqual(rows['garbage'], 'Fecha inválida')
+        self.assertNotIn('failed', rows)
+        self.assertEqual(rows['ok'], gdr.format_timestamp(1758535067))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 """
 Script para analizar cambios y generar reportes detallados
 """
+import hashlib
 import sqlite3
 import json
 import os
@@ -9,6 +10,80 @@ import yaml
 from datetime import datetime
 from pathlib import Path
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Formato de las fechas legibles del reporte
+READABLE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# urls.yaml ya procesado (guid -> [url, nombre]), indexado por (mtime, tamaño)
+URLS_CONFIG_CACHE = Path(".urlwatch/urls.cache.json")
+# Incrementar al cambiar el cálculo del GUID o el formato (url, nombre):
+# invalida el mapa memorizado aunque urls.yaml no haya cambiado
+URLS_CONFIG_VERSION = 1
+
+# Resultado memorizado del análisis de CacheEntry, indexado por (mtime, tamaño)
+SITES_INFO_CACHE = Path("logs/.cache_info.json")
+# Incrementar al cambiar la consulta o los campos de sites_info: invalida
+# el análisis memorizado aunque cache.db no haya cambiado
+SITES_INFO_VERSION = 1
+
+def load_cached_sites_info(signature):
+    """Devuelve el análisis memorizado si cache.db no ha cambiado"""
+    try:
+        with open(SITES_INFO_CACHE, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('version') == SITES_INFO_VERSION and cached.get('signature') == signature:
+            return cached['sites_info']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def save_cached_sites_info(signature, sites_info):
+    """Memoriza el análisis de CacheEntry junto a la firma de cache.db"""
+    try:
+        os.makedirs("logs", exist_ok=True)
+        with open(SITES_INFO_CACHE, 'w', encoding='utf-8') as f:
+            json.dump({'version': SITES_INFO_VERSION, 'signature': signature,
+                       'sites_info': sites_info}, f)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el análisis en cache: {e}")
+
+def load_urls_config(urls_file):
+    """Mapa guid -> (url, nombre) de urls.yaml, reutilizando el parseo anterior si no ha cambiado"""
+    st = urls_file.stat()
+    signature = [st.st_mtime_ns, st.st_size]
+    try:
+        with open(URLS_CONFIG_CACHE, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('version') == URLS_CONFIG_VERSION and cached.get('signature') == signature:
+            return {guid: tuple(entry) for guid, entry in cached['urls'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    
+    urls_config = {}
+    with open(urls_file, 'rb') as f:
+        # Cargar múltiples documentos YAML (libyaml decodifica los bytes)
+        for job in yaml.load_all(f, Loader=_Loader):
+            if isinstance(job, dict) and 'url' in job:
+                guid = hashlib.sha1(job['url'].encode()).hexdigest()
+                urls_config[guid] = (job['url'], job.get('name', job['url']))
+    
+    try:
+        with open(URLS_CONFIG_CACHE, 'w', encoding='utf-8') as f:
+            json.dump({'version': URLS_CONFIG_VERSION, 'signature': signature,
+                       'urls': urls_config}, f)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar urls.yaml procesado: {e}")
+    return urls_config
+
 def analyze_cache_changes():
     """Analiza la cache y genera reporte de cambios"""
     
@@ -17,71 +92,88 @@ def analyze_cache_changes():
         print("❌ No se encontró archivo de cache")
         return
     
-    # Cargar URLs desde el archivo de configuración
+    # Cargar URLs desde el archivo de configuración, indexadas por el GUID
+    # que urlwatch les asigna (SHA-1 de la URL)
     urls_config = {}
     try:
-        with open(".urlwatch/urls.yaml", 'r') as f:
-            # Cargar múltiples documentos YAML
-            urls_data = list(yaml.safe_load_all(f))
-            for job in urls_data:
-                if isinstance(job, dict) and 'name' in job and 'url' in job:
-                    urls_config[job['url']] = job['name']
+        urls_config = load_urls_config(Path(".urlwatch/urls.yaml"))
     except Exception as e:
         print(f"⚠️ Error cargando configuración de URLs: {e}")
     
     try:
-        conn = sqlite3.connect(str(cache_file))
-        cursor = conn.cursor()
+        # Reutilizar el análisis anterior si cache.db no ha cambiado; en ese
+        # caso ni siquiera se abre la base de datos
+        st = cache_file.stat()
+        signature = [st.st_mtime_ns, st.st_size]
+        sites_info = load_cached_sites_info(signature)
         
-        # Obtener todas las entradas ordenadas por timestamp
-        cursor.execute("""
-            SELECT guid, timestamp, tries, etag, 
-                   CASE WHEN data IS NULL THEN 0 ELSE 1 END as has_data,
-                   length(data) as data_length
-            FROM CacheEntry 
-            ORDER BY timestamp DESC
-        """)
-        
-        results = cursor.fetchall()
-        current_time = datetime.now()
-        
-        # Procesar resultados
-        sites_info = {}
-        for row in results:
-            guid, timestamp, tries, etag, has_data, data_length = row
+        if sites_info is None:
+            # Solo lectura: sin journal ni escalado de bloqueos
+            conn = sqlite3.connect(f"{cache_file.resolve().as_uri()}?mode=ro", uri=True)
+            conn.execute("PRAGMA query_only=1")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-65536")
+            conn.execute("PRAGMA mmap_size=268435456")
+            cursor = conn.cursor()
+            
+            # Obtener la última entrada de cada GUID y su número de entradas;
+            # SQLite agrupa y ordena, sin recorrer todas las filas en Python, y
+            # length(data) solo se calcula para las filas seleccionadas. La
+            # conexión es de solo lectura: el índice (guid, timestamp) que
+            # acelera esta consulta lo crea generate_detailed_report.py --create-index
+            cursor.execute("""
+                SELECT guid, timestamp, tries, etag, has_data,
+                       (SELECT length(data) FROM CacheEntry WHERE id = latest.id) as data_length,
+                       entries_count
+                FROM (
+                    SELECT id, guid, timestamp, tries, etag,
+                           data IS NOT NULL as has_data,
+                           COUNT(*) OVER (PARTITION BY guid) as entries_count,
+                           ROW_NUMBER() OVER (PARTITION BY guid ORDER BY timestamp DESC) as rn
+                    FROM CacheEntry
+                ) as latest
+                WHERE rn = 1
+            """)
             
-            if guid not in sites_info:
-                sites_info[guid] = {
+            # Procesar resultados directamente desde el cursor, sin fetchall()
+            sites_info = {
+                guid: {
                     'latest_timestamp': timestamp,
                     'latest_tries': tries,
                     'has_data': has_data,
                     'data_length': data_length or 0,
-                    'entries_count': 0
+                    'entries_count': entries_count
                 }
+                for guid, timestamp, tries, etag, has_data, data_length, entries_count
+                in cursor
+            }
+            conn.close()
             
-            sites_info[guid]['entries_count'] += 1
+            save_cached_sites_info(signature, sites_info)
+        
+        current_time = datetime.now()
         
         # Generar reporte detallado
         report_data = {
             'generated_at': current_time.isoformat(),
-            'generated_readable': current_time.strftime("%d/%m/%Y %H:%M:%S"),
+            'generated_readable': current_time.strftime(READABLE_FORMAT),
             'sites': {}
         }
         
-        # Por cada GUID, intentar encontrar la URL correspondiente
-        cursor.execute("SELECT DISTINCT guid FROM CacheEntry")
-        guids = cursor.fetchall()
+        # Reporte legible, construido en el mismo recorrido y escrito de una vez
+        parts = [
+            "=" * 80 + "\n",
+            "🔍 ESTADO DETALLADO DE MONITOREO URLWatch\n",
+            f"📅 Generado: {report_data['generated_readable']}\n",
+            "=" * 80 + "\n\n",
+        ]
         
-        for (guid,) in guids:
-            site_info = sites_info.get(guid, {})
-            
-            # Buscar en el historial para obtener URL
-            cursor.execute("SELECT url FROM CacheEntry WHERE guid = ? LIMIT 1", (guid,))
-            url_result = cursor.fetchone()
-            
-            if url_result and url_result[0]:
-                url = url_result[0]
-                site_name = urls_config.get(url, url)
+        # Un único recorrido: el análisis ya contiene cada GUID de CacheEntry;
+        # cada sitio se añade a la vez al reporte JSON y al legible
+        for guid, site_info in sites_info.items():
+            # CacheEntry no guarda la URL: se resuelve por GUID
+            if guid in urls_config:
+                url, site_name = urls_config[guid]
             else:
                 site_name = "Sitio desconocido"
                 url = f"guid:{guid}"
@@ -91,7 +183,7 @@ def analyze_cache_changes():
                 try:
                     formatted_date = datetime.fromtimestamp(
                         site_info['latest_timestamp']
-                    ).strftime("%d/%m/%Y %H:%M:%S")
+                    ).strftime(READABLE_FORMAT)
                 except:
                     pass
             
@@ -99,38 +191,38 @@ def analyze_cache_changes():
             if site_info.get('latest_tries', 0) > 1:
                 status += f" ({site_info['latest_tries']} intentos)"
             
+            data_size = site_info.get('data_length', 0)
+            total_checks = site_info.get('entries_count', 0)
             report_data['sites'][guid] = {
                 'name': site_name,
                 'url': url,
                 'last_check': formatted_date,
                 'status': status,
-                'data_size': site_info.get('data_size', 0),
-                'total_checks': site_info.get('entries_count', 0)
+                'data_size': data_size,
+                'total_checks': total_checks
             }
+            parts.append(
+                f"📊 {site_name}\n"
+                f"🌐 {url}\n"
+                f"📅 Última verificación: {formatted_date}\n"
+                f"✅ Estado: {status}\n"
+                f"📏 Tamaño datos: {data_size} bytes\n"
+                f"🔢 Total verificaciones: {total_checks}\n"
+                + "-" * 60 + "\n\n"
+            )
         
         # Guardar reporte
         os.makedirs("logs", exist_ok=True)
-        with open("logs/change_history.json", 'w') as f:
-            json.dump(report_data, f, indent=2)
+        with open("logs/change_history.json", 'wb') as f:
+            if orjson is not None:
+                f.write(orjson.dumps(report_data, option=orjson.OPT_INDENT_2))
+            else:
+                f.write(json.dumps(report_data, indent=2, ensure_ascii=False).encode('utf-8'))
         
-        # Generar reporte legible
-        with open("logs/sites_status.txt", 'w') as f:
-            f.write("=" * 80 + "\n")
-            f.write("🔍 ESTADO DETALLADO DE MONITOREO URLWatch\n")
-            f.write(f"📅 Generado: {report_data['generated_readable']}\n") 
-            f.write("=" * 80 + "\n\n")
-            
-            for guid, site in report_data['sites'].items():
-                f.write(f"📊 {site['name']}\n")
-                f.write(f"🌐 {site['url']}\n")
-                f.write(f"📅 Última verificación: {site['last_check']}\n")
-                f.write(f"✅ Estado: {site['status']}\n")
-                f.write(f"📏 Tamaño datos: {site['data_size']} bytes\n")
-                f.write(f"🔢 Total verificaciones: {site['total_checks']}\n")
-                f.write("-" * 60 + "\n\n")
+        with open("logs/sites_status.txt", 'w', encoding='utf-8') as f:
+            f.write("".join(parts))
         
         print("✅ Análisis de cambios completado")
-        conn.close()
         
     except Exception as e:
         print(f"❌ Error analizando cache: {e}")